@@ -6,7 +6,9 @@ CLEAN_PATHS = [
     "data/zip",
     "data/csv",
     "data/hash",
+    "data/duckdb_tmp",
     "metadata/file_metadata.csv",
+    "metadata/file_stage_journal.csv",
     "data/divvy.duckdb",
 ]
 
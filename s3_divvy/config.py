@@ -11,6 +11,7 @@ DOWNLOAD_DIR = os.path.join(DATA_DIR, "zip")
 EXTRACT_DIR = os.path.join(DATA_DIR, "csv")
 HASH_DIR = os.path.join(DATA_DIR, "hash")
 DUCKDB_PATH = os.path.join(DATA_DIR, "divvy.duckdb")
+DUCKDB_TEMP_DIR = os.getenv("DUCKDB_TEMP_DIR", os.path.join(DATA_DIR, "duckdb_tmp"))
 
 # Download method
 USE_BOTO3_DOWNLOAD = os.getenv("USE_BOTO3_DOWNLOAD", "false").lower() == "true"
@@ -18,10 +19,32 @@ USE_BOTO3_DOWNLOAD = os.getenv("USE_BOTO3_DOWNLOAD", "false").lower() == "true"
 # Metadata + Logging paths
 METADATA_PATH = os.path.join(BASE_DIR, "..", "metadata", "file_metadata.csv")
 INGESTION_LOG_PATH = os.path.join(os.path.dirname(METADATA_PATH), "file_ingestion_log.csv")
+DATA_VERSION_PATH = os.path.join(os.path.dirname(METADATA_PATH), "data_version.txt")
+STAGE_JOURNAL_PATH = os.path.join(os.path.dirname(METADATA_PATH), "file_stage_journal.csv")
 
 # Create directories if not present
 for directory in [DOWNLOAD_DIR, EXTRACT_DIR, HASH_DIR, os.path.dirname(METADATA_PATH), os.path.dirname(INGESTION_LOG_PATH)]:
     os.makedirs(directory, exist_ok=True)
 
 # MODE
-QUALITY_CHECK_MODE = os.getenv("QUALITY_CHECK_MODE", "false").lower() == "true"
\ No newline at end of file
+QUALITY_CHECK_MODE = os.getenv("QUALITY_CHECK_MODE", "false").lower() == "true"
+
+# Stage journal retries (exponential backoff starting at STAGE_BACKOFF_SEC)
+STAGE_MAX_ATTEMPTS = int(os.getenv("STAGE_MAX_ATTEMPTS", "3"))
+STAGE_BACKOFF_SEC = float(os.getenv("STAGE_BACKOFF_SEC", "2"))
+
+# DuckDB resource governor (0 = derive from host)
+DUCKDB_MAX_THREADS = int(os.getenv("DUCKDB_MAX_THREADS", "0"))
+DUCKDB_MEMORY_LIMIT_MB = int(os.getenv("DUCKDB_MEMORY_LIMIT_MB", "0"))
+DUCKDB_MEMORY_FRACTION = float(os.getenv("DUCKDB_MEMORY_FRACTION", "0.6"))
+
+# Spatial grid: stored geohash precision per trip endpoint, and OD aggregate zoom levels
+SPATIAL_CELL_PRECISION = int(os.getenv("SPATIAL_CELL_PRECISION", "7"))
+SPATIAL_OD_PRECISIONS = [int(p) for p in os.getenv("SPATIAL_OD_PRECISIONS", "4,5,6").split(",")]
+
+# Query service (read-side concurrency limit + result cache)
+QUERY_MAX_CONCURRENT = int(os.getenv("QUERY_MAX_CONCURRENT", "4"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+QUERY_HOST = os.getenv("QUERY_HOST", "127.0.0.1")
+QUERY_PORT = int(os.getenv("QUERY_PORT", "8765"))
@@ -45,26 +45,68 @@ def download_file(file_name: str):
         logger.info(f"File already exists: {file_name}")
         return local_path
 
+    # Stream to a .part file so an interrupted download never looks complete
+    part_path = local_path + ".part"
     try:
         logger.info(f"Downloading {file_url}")
         with requests.get(file_url, stream=True) as r:
             r.raise_for_status()
-            with open(local_path, "wb") as f:
+            with open(part_path, "wb") as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     f.write(chunk)
+        os.replace(part_path, local_path)
         logger.info(f"Downloaded: {file_name}")
         return local_path
     except Exception as e:
         logger.exception(f"Download failed for {file_url}: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
         return None
 
+def verify_zip(file_path: str):
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            bad_member = zip_ref.testzip()
+        if bad_member is not None:
+            logger.error(f"Corrupt member {bad_member} in {file_path}")
+            return False
+        return True
+    except zipfile.BadZipFile as e:
+        logger.error(f"Invalid zip {file_path}: {e}")
+        return False
+
+def classify_member(member_name: str) -> str:
+    # Older quarterly/yearly archives bundle station lists and macOS metadata with the trips
+    parts = member_name.replace("\\", "/").split("/")
+    base_name = parts[-1]
+    if (
+        not base_name
+        or "__MACOSX" in parts
+        or base_name.startswith(".")
+        or not base_name.lower().endswith(".csv")
+    ):
+        return "junk"
+    if "station" in base_name.lower():
+        return "station"
+    return "trip"
+
+def list_extracted_members(extract_path: str):
+    # Read from the extracted tree, so ingest still works once the zip itself is gone
+    names = []
+    for root, _, files in os.walk(extract_path):
+        for name in files:
+            names.append(os.path.relpath(os.path.join(root, name), extract_path))
+    return [(name, classify_member(name)) for name in sorted(names)]
+
 def extract_zip(file_path: str, extract_to: str):
     try:
         with zipfile.ZipFile(file_path, 'r') as zip_ref:
             zip_ref.extractall(extract_to)
         logger.info(f"Extracted {file_path} to {extract_to}")
+        return True
     except zipfile.BadZipFile as e:
         logger.error(f"Failed to extract {file_path}: {e}")
+        return False
 
 def save_file_hash(file_path: str):
     hash_path = os.path.join(HASH_DIR, os.path.basename(file_path) + ".sha256")
@@ -75,4 +117,5 @@ def save_file_hash(file_path: str):
     with open(hash_path, 'w') as hash_file:
         hash_file.write(sha256.hexdigest())
     logger.info(f"Hash saved: {hash_path}")
+    return hash_path
     
\ No newline at end of file
@@ -0,0 +1,30 @@
+import os
+import logging
+import threading
+from . import config
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+
+def get_data_version() -> int:
+    version_path = config.DATA_VERSION_PATH  # dynamically access current value
+    try:
+        with open(version_path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+    except ValueError:
+        logger.warning(f"Unreadable data version in {version_path}, treating as 0")
+        return 0
+
+def bump_data_version() -> int:
+    # Written to a temp file and swapped in so readers never see a partial value
+    version_path = config.DATA_VERSION_PATH
+    with _lock:
+        new_version = get_data_version() + 1
+        tmp_path = version_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(new_version))
+        os.replace(tmp_path, version_path)
+    logger.info(f"Data version bumped to {new_version}")
+    return new_version
@@ -0,0 +1,127 @@
+import logging
+from . import config, data_version, spatial
+
+logger = logging.getLogger(__name__)
+
+# Typed metrics stored on every 'trips' row so analyses never re-derive them per query
+DERIVED_COLUMNS = {
+    "ride_length_sec": "DOUBLE",
+    "day_of_week": "TINYINT",   # 0 = Sunday ... 6 = Saturday
+    "hour_of_day": "TINYINT",
+    "ride_distance_km": "DOUBLE",
+    "start_cell": "VARCHAR",    # geohash at config.SPATIAL_CELL_PRECISION
+    "end_cell": "VARCHAR",
+}
+
+# Source columns by schema era, most recent first (2020+, 2013-2019, 2018 Q1 export)
+START_TIME_COLUMNS = ["started_at", "start_time", "01 - Rental Details Local Start Time"]
+END_TIME_COLUMNS = ["ended_at", "end_time", "01 - Rental Details Local End Time"]
+DURATION_COLUMNS = ["tripduration", "01 - Rental Details Duration In Seconds Uncapped"]
+COORDINATE_COLUMNS = ["start_lat", "start_lng", "end_lat", "end_lng"]
+
+TIMESTAMP_FORMATS = ["%m/%d/%Y %H:%M:%S", "%m/%d/%Y %H:%M"]
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _present(candidates: list, columns: list) -> list:
+    by_lower = {c.lower(): c for c in columns}
+    return [by_lower[c.lower()] for c in candidates if c.lower() in by_lower]
+
+
+def _coalesce(exprs: list, cast: str) -> str:
+    if not exprs:
+        return f"CAST(NULL AS {cast})"
+    return exprs[0] if len(exprs) == 1 else f"COALESCE({', '.join(exprs)})"
+
+
+def _timestamp(column: str) -> str:
+    # ISO timestamps cast directly; 2013-2017 exports use US month/day order
+    text = f"CAST({_ident(column)} AS VARCHAR)"
+    parsers = [f"TRY_CAST({_ident(column)} AS TIMESTAMP)"]
+    parsers += [f"try_strptime({text}, '{fmt}')" for fmt in TIMESTAMP_FORMATS]
+    return f"COALESCE({', '.join(parsers)})"
+
+
+def _number(column: str) -> str:
+    # 2019 exports format tripduration with thousands separators ("1,035.0")
+    return f"TRY_CAST(replace(CAST({_ident(column)} AS VARCHAR), ',', '') AS DOUBLE)"
+
+
+def derived_exprs(columns: list) -> dict:
+    """Typed SQL expression for every DERIVED_COLUMNS entry, given the available source columns."""
+    started = _coalesce([_timestamp(c) for c in _present(START_TIME_COLUMNS, columns)], "TIMESTAMP")
+    ended = _coalesce([_timestamp(c) for c in _present(END_TIME_COLUMNS, columns)], "TIMESTAMP")
+    duration = [_number(c) for c in _present(DURATION_COLUMNS, columns)]
+
+    ride_length = _coalesce(duration + [f"epoch({ended}) - epoch({started})"], "DOUBLE")
+
+    coordinates = _present(COORDINATE_COLUMNS, columns)
+    if len(coordinates) == len(COORDINATE_COLUMNS):
+        start_lat, start_lng, end_lat, end_lng = (_number(c) for c in coordinates)
+        distance = spatial.haversine_sql(start_lat, start_lng, end_lat, end_lng)
+        start_cell = spatial.geohash_sql(start_lat, start_lng, config.SPATIAL_CELL_PRECISION)
+        end_cell = spatial.geohash_sql(end_lat, end_lng, config.SPATIAL_CELL_PRECISION)
+    else:
+        # Pre-2020 files only carry station ids, not coordinates
+        distance = "CAST(NULL AS DOUBLE)"
+        start_cell = end_cell = "CAST(NULL AS VARCHAR)"
+
+    exprs = {
+        "ride_length_sec": ride_length,
+        "day_of_week": f"dayofweek({started})",
+        "hour_of_day": f"hour({started})",
+        "ride_distance_km": distance,
+        "start_cell": start_cell,
+        "end_cell": end_cell,
+    }
+    return {name: f"CAST({exprs[name]} AS {dtype})" for name, dtype in DERIVED_COLUMNS.items()}
+
+
+def derived_select(columns: list) -> str:
+    return ", ".join(f"{expr} AS {name}" for name, expr in derived_exprs(columns).items())
+
+
+def table_columns(con, table_name: str) -> list:
+    return [row[0] for row in con.execute(f"DESCRIBE {table_name}").fetchall()]
+
+
+def ensure_trips_columns(con, source_columns: list):
+    # Later schema eras bring new raw columns; add them (and the derived ones) before INSERT BY NAME
+    existing = {c.lower() for c in table_columns(con, "trips")}
+    for column in source_columns:
+        if column.lower() not in existing:
+            con.execute(f"ALTER TABLE trips ADD COLUMN {_ident(column)} VARCHAR")
+    for name, dtype in DERIVED_COLUMNS.items():
+        if name not in existing:
+            con.execute(f"ALTER TABLE trips ADD COLUMN {name} {dtype}")
+
+
+def backfill_trips(con, recompute: bool = False) -> int:
+    """Fill derived columns on existing 'trips' rows; returns the number of rows updated."""
+    source_columns = [
+        c for c in table_columns(con, "trips")
+        if c not in DERIVED_COLUMNS and c != "source_file"
+    ]
+    ensure_trips_columns(con, [])
+
+    exprs = derived_exprs(source_columns)
+    if recompute:
+        assignments = ", ".join(f"{name} = {expr}" for name, expr in exprs.items())
+        where = ""
+    else:
+        # Only fill gaps the source data can actually fill (e.g. columns added by a later
+        # release); pre-2020 rows never get coordinates, so they must not match forever
+        assignments = ", ".join(f"{name} = COALESCE({name}, {expr})" for name, expr in exprs.items())
+        where = "WHERE " + " OR ".join(
+            f"({name} IS NULL AND {expr} IS NOT NULL)" for name, expr in exprs.items()
+        )
+
+    updated = con.execute(f"UPDATE trips SET {assignments} {where}").fetchone()[0]
+
+    logger.info(f"Backfilled derived columns on {updated} trips rows")
+    if updated:
+        data_version.bump_data_version()
+    return updated
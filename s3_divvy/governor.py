@@ -0,0 +1,173 @@
+import os
+import math
+import logging
+import duckdb
+from . import config
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+# Working memory DuckDB needs per scan thread before it starts spilling
+MEMORY_PER_THREAD = 256 * MIB
+# Below this much CSV per thread, extra threads cost more than they save
+BYTES_PER_THREAD = 32 * MIB
+# Rough in-memory footprint of a VARCHAR-loaded CSV relative to its size on disk
+MEMORY_PER_INPUT_BYTE = 4
+MIN_MEMORY_LIMIT = 512 * MIB
+
+_connection = None
+_connection_path = None
+_dialect_cache = {}
+
+
+def host_cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def host_memory_bytes() -> int:
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        total = 4 * 1024 * MIB
+
+    # Containers report the host's RAM above; the cgroup limit is the real budget
+    for cgroup_path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(cgroup_path) as f:
+                value = f.read().strip()
+            if value.isdigit():
+                total = min(total, int(value))
+        except OSError:
+            continue
+    return total
+
+
+def plan_resources(file_size: int) -> dict:
+    if config.DUCKDB_MEMORY_LIMIT_MB > 0:
+        budget = config.DUCKDB_MEMORY_LIMIT_MB * MIB
+    else:
+        budget = int(host_memory_bytes() * config.DUCKDB_MEMORY_FRACTION)
+    budget = max(budget, MIN_MEMORY_LIMIT)
+
+    memory_limit = min(budget, max(MIN_MEMORY_LIMIT, file_size * MEMORY_PER_INPUT_BYTE))
+
+    cpus = host_cpu_count()
+    if config.DUCKDB_MAX_THREADS > 0:
+        cpus = min(cpus, config.DUCKDB_MAX_THREADS)
+    threads = min(
+        cpus,
+        max(1, math.ceil(file_size / BYTES_PER_THREAD)),
+        max(1, memory_limit // MEMORY_PER_THREAD),
+    )
+
+    return {
+        "threads": threads,
+        "memory_limit": f"{memory_limit // MIB}MiB",
+        "temp_directory": config.DUCKDB_TEMP_DIR,
+        "preserve_insertion_order": False,
+    }
+
+
+def get_connection():
+    global _connection, _connection_path
+    if _connection is None or _connection_path != config.DUCKDB_PATH:
+        close_connection()
+        _connection = duckdb.connect(config.DUCKDB_PATH)
+        _connection_path = config.DUCKDB_PATH
+    return _connection
+
+
+def close_connection():
+    global _connection, _connection_path
+    if _connection is not None:
+        _connection.close()
+    _connection = None
+    _connection_path = None
+
+
+def apply_plan(con, plan: dict):
+    os.makedirs(plan["temp_directory"], exist_ok=True)
+    temp_directory = plan["temp_directory"].replace("'", "''")
+    con.execute(f"SET threads = {plan['threads']}")
+    con.execute(f"SET memory_limit = '{plan['memory_limit']}'")
+    con.execute(f"SET temp_directory = '{temp_directory}'")
+    con.execute(f"SET preserve_insertion_order = {str(plan['preserve_insertion_order']).lower()}")
+    logger.info(
+        f"DuckDB plan: threads={plan['threads']}, memory_limit={plan['memory_limit']}, "
+        f"temp_directory={plan['temp_directory']}"
+    )
+
+
+def governed_connection(file_size: int):
+    con = get_connection()
+    apply_plan(con, plan_resources(file_size))
+    return con
+
+
+def database_connection():
+    # Whole-table work (OD rebuilds, backfills) scans all of 'trips': size it for the database
+    # file, not for whichever member the shared connection was last tuned to ingest
+    con = get_connection()
+    apply_plan(con, plan_resources(os.path.getsize(config.DUCKDB_PATH)))
+    return con
+
+
+def schema_era(file_path: str) -> str:
+    # Files sharing a header line share a dialect, so the header identifies the era
+    with open(file_path, encoding="utf-8-sig", errors="replace") as f:
+        header = f.readline()
+    return "".join(header.split()).lower()
+
+
+def sniff_dialect(con, file_path: str):
+    era = schema_era(file_path)
+    if era in _dialect_cache:
+        return _dialect_cache[era]
+
+    # Both ingest modes tolerate bad rows, so the sniffer must too or it misreads the dialect
+    try:
+        row = con.execute(f"""
+            SELECT Delimiter, Quote, Escape, SkipRows, HasHeader, Columns
+            FROM sniff_csv('{file_path}', sample_size=-1, all_varchar=TRUE, ignore_errors=TRUE)
+        """).fetchone()
+    except Exception as e:
+        logger.warning(f"Could not sniff dialect of {file_path}, falling back to auto-detect: {e}")
+        return None
+
+    delimiter, quote, escape, skip_rows, has_header, columns = row
+    # A sample without quoted fields reports no quote char; later files of the era may need one
+    quote = '"' if quote == "(empty)" else quote
+    dialect = {
+        "delim": delimiter,
+        "quote": quote,
+        "escape": quote if escape == "(empty)" else escape,
+        "skip": skip_rows,
+        "header": has_header,
+        "columns": [column["name"] for column in columns],
+    }
+    _dialect_cache[era] = dialect
+    logger.info(f"Cached CSV dialect for schema era of {os.path.basename(file_path)}")
+    return dialect
+
+
+def clear_dialect_cache():
+    _dialect_cache.clear()
+
+
+def dialect_options(dialect) -> str:
+    # read_csv options that skip sniffing entirely, or a full-sample sniff if unknown
+    if dialect is None:
+        return "all_varchar=TRUE, sample_size=-1"
+
+    def quoted(value):
+        return "'" + str(value).replace("'", "''") + "'"
+
+    columns = ", ".join(f"{quoted(name)}: 'VARCHAR'" for name in dialect["columns"])
+    return (
+        f"auto_detect=FALSE, delim={quoted(dialect['delim'])}, quote={quoted(dialect['quote'])}"
+        f", escape={quoted(dialect['escape'])}, skip={dialect['skip']}"
+        f", header={str(dialect['header']).upper()}, columns={{{columns}}}"
+    )
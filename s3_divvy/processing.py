@@ -1,48 +1,75 @@
 ### processing.py
 import os
+import re
+import glob
 import pandas as pd
-import duckdb
 import logging
-from . import config
+from . import config, data_version, derived, governor
 # from .config import DUCKDB_PATH, EXTRACT_DIR
 
 logger = logging.getLogger(__name__)
 
-def process_csv_file(file_path: str, mode: str = "pandas", quality_check: bool = False):
-    logger.info(f"Processing file: {file_path} with mode: {mode}, quality_check={quality_check}")
+def _source_name(file_path: str) -> str:
+    return os.path.basename(file_path).replace(".csv", "")
+
+def _table_name(base_name: str) -> str:
+    return f"t_{re.sub(r'[^0-9A-Za-z_]', '_', base_name)}"
+
+def _sql_str(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def process_csv_members(file_paths: list, archive_name: str, quality_check: bool = False):
+    """Ingest several CSVs (e.g. every trip member of one zip) into 'trips'.
+
+    Members sharing a schema era are read in one parallel multi-file scan; each keeps
+    its own source_file. Returns {source_file: {"status", "inserted_rows", "reject_count"}};
+    if an era fails, the eras already committed keep their results and the rest are "failed".
+    """
+    logger.info(f"Processing {len(file_paths)} member(s) of {archive_name}, quality_check={quality_check}")
+    results = {}
+    committed = False
     try:
-        if mode == "duckdb":
-            con = duckdb.connect(config.DUCKDB_PATH)
-
-            # Extract table name from file name
-            base_name = os.path.basename(file_path).replace(".csv", "")
-            table_name = f"t_{base_name.replace('-', '_').replace(' ', '_')}"
-
-            # 🔄 Set DuckDB parameters based on quality_check flag
-            """ defaults:
-            all_varchar: false
-            auto_detect: true
-            ignore_errors: false
-            rejects_table: reject_errors
-            store_rejects: false
-            strict_mode: true
-            sample_size: 20480
-            union_by_name: false
-            """
-            
+        # Reuse the tuned connection, sized for the whole batch
+        con = governor.governed_connection(sum(os.path.getsize(p) for p in file_paths))
+
+        # Sniff once per schema era (full sample), then scan each era's members together
+        eras = {}
+        for path in file_paths:
+            eras.setdefault(governor.schema_era(path), []).append(path)
+
+        """ defaults:
+        all_varchar: false
+        auto_detect: true
+        ignore_errors: false
+        rejects_table: reject_errors
+        store_rejects: false
+        strict_mode: true
+        sample_size: 20480
+        union_by_name: false
+        """
+
+        for i, paths in enumerate(eras.values()):
+            table_name = _table_name(archive_name if len(eras) == 1 else f"{archive_name}_{i}")
+            csv_options = governor.dialect_options(governor.sniff_dialect(con, paths[0]))
+            path_list = "[" + ", ".join(_sql_str(p) for p in paths) + "]"
+
             if quality_check:
+                # Rejects tables persist on the reused connection, so start clean
+                con.execute("DROP TABLE IF EXISTS rejects")
+                con.execute("DROP TABLE IF EXISTS reject_scans")
+
                 # Strict mode: don't set ignore_errors or union_by_name, allow rejects_table
                 query_create_raw = f"""
                     CREATE OR REPLACE TABLE {table_name} AS 
                     SELECT * 
-                    FROM read_csv_auto('{file_path}'
-                        -- All columns forced to string
-                        , all_varchar=TRUE
+                    FROM read_csv({path_list}
+                        -- All columns VARCHAR, dialect from cache or full-sample sniff
+                        , {csv_options}
                         -- Required for tracking malformed rows
                         , store_rejects=TRUE
                         , rejects_table='rejects'
-                        -- Disable sampling
-                        , sample_size=-1
+                        -- Per-member lineage
+                        , filename=TRUE
                     )
                 """
             else:
@@ -50,68 +77,131 @@ def process_csv_file(file_path: str, mode: str = "pandas", quality_check: bool =
                 query_create_raw = f"""
                     CREATE OR REPLACE TABLE {table_name} AS 
                     SELECT * 
-                    FROM read_csv_auto('{file_path}'
-                        -- All columns forced to string
-                        , all_varchar=TRUE
+                    FROM read_csv({path_list}
+                        -- All columns VARCHAR, dialect from cache or full-sample sniff
+                        , {csv_options}
                         -- Skip bad rows automatically
                         , ignore_errors=TRUE
                         -- Align by column names
                         , union_by_name=TRUE
-                        -- Disable sampling
-                        , sample_size=-1
+                        -- Per-member lineage
+                        , filename=TRUE
                     )
                 """
 
             con.execute(query_create_raw)
             logger.info(f"Raw table created: {table_name}")
 
-            # If quality_check is enabled, validate there are no rejected rows
+            # If quality_check is enabled, members with rejected rows are held back
+            reject_counts = {}
             if quality_check:
-                rejects = con.execute("SELECT COUNT(*) FROM rejects").fetchone()[0]
-                if rejects > 0:
-                    logger.warning(f"Rejects found in quality check: {rejects} rows")
-                    con.close()
-                    return None
+                reject_counts = dict(con.execute("""
+                    SELECT s.file_path, COUNT(*)
+                    FROM rejects r JOIN reject_scans s USING (scan_id, file_id)
+                    GROUP BY 1
+                """).fetchall())
+                for path, rejects in reject_counts.items():
+                    logger.warning(f"Rejects found in quality check for {path}: {rejects} rows")
+
+            clean_paths = [p for p in paths if reject_counts.get(p, 0) == 0]
+            for path in paths:
+                if path not in clean_paths:
+                    results[_source_name(path)] = {
+                        "status": "rejected", "inserted_rows": 0, "reject_count": reject_counts[path]
+                    }
+            if not clean_paths:
+                continue
 
-            # Count rows in raw table
-            raw_count = con.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            source_file = "CASE filename " + " ".join(
+                f"WHEN {_sql_str(p)} THEN {_sql_str(_source_name(p))}" for p in clean_paths
+            ) + " END"
+            clean_list = ", ".join(_sql_str(p) for p in clean_paths)
+            source_list = ", ".join(_sql_str(_source_name(p)) for p in clean_paths)
 
-            # Create 'trips' table structure if it doesn't exist
+            # Typed metrics derived once here instead of in every downstream query
+            raw_columns = [c for c in derived.table_columns(con, table_name) if c != "filename"]
+            derived_columns = derived.derived_select(raw_columns)
+
+            # Create 'trips' table structure if it doesn't exist, or widen it for a new schema era
             con.execute(f"""
                 CREATE TABLE IF NOT EXISTS trips AS 
-                SELECT *, '{base_name}' AS source_file 
+                SELECT * EXCLUDE (filename), '' AS source_file, {derived_columns} 
                 FROM {table_name} 
                 LIMIT 0
             """)
+            derived.ensure_trips_columns(con, raw_columns)
 
-            # Insert new data
-            con.execute(f"""
-                INSERT INTO trips 
-                SELECT *, '{base_name}' AS source_file 
-                FROM {table_name}
-            """)
+            # Replace any rows from an earlier (possibly interrupted) run of these members,
+            # so resuming an ingest never duplicates data
+            con.execute("BEGIN TRANSACTION")
+            try:
+                con.execute(f"DELETE FROM trips WHERE source_file IN ({source_list})")
+                con.execute(f"""
+                    INSERT INTO trips BY NAME 
+                    SELECT * EXCLUDE (filename), {source_file} AS source_file, {derived_columns} 
+                    FROM {table_name}
+                    WHERE filename IN ({clean_list})
+                """)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            committed = True
+
+            # Count rows per member
+            raw_counts = dict(con.execute(f"""
+                SELECT filename, COUNT(*) FROM {table_name} GROUP BY 1
+            """).fetchall())
+            inserted_counts = dict(con.execute(f"""
+                SELECT source_file, COUNT(*) FROM trips WHERE source_file IN ({source_list}) GROUP BY 1
+            """).fetchall())
+
+            for path in clean_paths:
+                base_name = _source_name(path)
+                inserted = inserted_counts.get(base_name, 0)
+                logger.info(f"Inserted {inserted} of {raw_counts.get(path, 0)} rows from: {path}")
+                results[base_name] = {"status": "success", "inserted_rows": inserted, "reject_count": 0}
+
+        return results
 
-            # Count rows inserted
-            inserted_count = con.execute(f"""
-                SELECT COUNT(*) FROM trips WHERE source_file = '{base_name}'
-            """).fetchone()[0]
+    except Exception as e:
+        logger.error(f"Failed to process members of {archive_name}: {e}")
+        for path in file_paths:
+            results.setdefault(_source_name(path), {"status": "failed", "inserted_rows": 0, "reject_count": 0})
+        return results
+
+    finally:
+        # Earlier eras stay committed when a later one fails; readers must still see them
+        if committed:
+            data_version.bump_data_version()
 
-            logger.info(f"Inserted {inserted_count} of {raw_count} rows from: {file_path}")
-            con.close()
+def process_csv_file(file_path: str, mode: str = "pandas", quality_check: bool = False):
+    logger.info(f"Processing file: {file_path} with mode: {mode}, quality_check={quality_check}")
+    try:
+        if mode == "duckdb":
+            base_name = _source_name(file_path)
+            results = process_csv_members([file_path], base_name, quality_check)
+            if not results or results[base_name]["status"] != "success":
+                return None
             return True
 
         elif mode == "bulk":
-            con = duckdb.connect(config.DUCKDB_PATH)
-            con.execute(f"""
-                CREATE OR REPLACE TABLE trips AS 
-                SELECT *, filename AS source_file 
-                FROM read_csv_auto('{config.EXTRACT_DIR}/*.csv'
+            csv_files = glob.glob(os.path.join(config.EXTRACT_DIR, "*.csv"))
+            con = governor.governed_connection(sum(os.path.getsize(f) for f in csv_files))
+            source = f"""
+                read_csv_auto('{config.EXTRACT_DIR}/*.csv'
                     , union_by_name=TRUE
                     , filename=TRUE
                 )
+            """
+            raw_columns = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+            con.execute(f"""
+                CREATE OR REPLACE TABLE trips AS 
+                SELECT *, filename AS source_file, {derived.derived_select(raw_columns)} 
+                FROM {source}
             """)
-            con.close()
             logger.info("Bulk-loaded all CSVs into unified 'trips' table")
+            data_version.bump_data_version()
             return True
 
         else:
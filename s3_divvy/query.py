@@ -0,0 +1,233 @@
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import duckdb
+import pandas as pd
+from . import config, data_version
+
+logger = logging.getLogger(__name__)
+
+# Quoted literals/identifiers are kept verbatim; everything else is case/whitespace folded
+_QUOTED_SQL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql: str) -> str:
+    parts = _QUOTED_SQL.split(sql.strip().rstrip(";").strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            normalized.append(part)
+        else:
+            normalized.append(re.sub(r"\s+", " ", part).lower())
+    return "".join(normalized).strip()
+
+
+class ResultCache:
+    """LRU cache of query results, bounded by entry count and approximate bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, df: pd.DataFrame):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            logger.info(f"Result of {size} bytes exceeds cache budget, not caching")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def check_select(con, sql: str):
+    # The HTTP endpoint takes arbitrary SQL; only a single read query may run
+    statements = con.extract_statements(sql)
+    if len(statements) != 1:
+        raise ValueError(f"Expected exactly one SQL statement, got {len(statements)}")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError(f"Only SELECT queries are allowed, got {statements[0].type.name}")
+
+
+class IngestInProgressError(RuntimeError):
+    """run_pipeline holds DuckDB's write lock, so no read-only connection can be opened."""
+
+
+class QueryConcurrencyLimit:
+    """Caps how many queries run at once; each one opens and closes its own read-only connection.
+
+    Deliberately not a pool: DuckDB lets one process write a database file *or* any number
+    read it, so idle pooled connections would keep run_pipeline from ever taking the write
+    lock. The price is a connection open (and a cold buffer cache) on every cache miss;
+    cache hits never open one. While an ingest holds the lock, misses raise
+    IngestInProgressError.
+    """
+
+    def __init__(self, db_path: str, max_concurrent: int):
+        self.db_path = db_path
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            # The database file is attached first; external access then blocks read_csv,
+            # COPY ... TO and ATTACH from reaching the rest of the filesystem
+            try:
+                con = duckdb.connect(self.db_path, read_only=True, config={"enable_external_access": False})
+            except duckdb.IOException as e:
+                if "lock" not in str(e).lower():
+                    raise
+                raise IngestInProgressError(
+                    f"Ingest in progress: {self.db_path} is locked for writing, retry when it finishes"
+                ) from e
+            try:
+                yield con
+            finally:
+                con.close()
+
+
+class QueryService:
+    def __init__(
+        self,
+        db_path: str = None,
+        max_concurrent: int = None,
+        cache_max_entries: int = None,
+        cache_max_bytes: int = None,
+    ):
+        self.limit = QueryConcurrencyLimit(
+            db_path or config.DUCKDB_PATH,
+            max_concurrent or config.QUERY_MAX_CONCURRENT,
+        )
+        self.cache = ResultCache(
+            cache_max_entries or config.QUERY_CACHE_MAX_ENTRIES,
+            cache_max_bytes or config.QUERY_CACHE_MAX_BYTES,
+        )
+        self._version = data_version.get_data_version()
+        self._version_lock = threading.Lock()
+
+    def _current_version(self) -> int:
+        version = data_version.get_data_version()
+        with self._version_lock:
+            if version != self._version:
+                logger.info(f"Data version {self._version} -> {version}, invalidating query cache")
+                self._version = version
+                self.cache.clear()
+        return version
+
+    def query(self, sql: str, params: list = None) -> pd.DataFrame:
+        version = self._current_version()
+        key = (version, normalize_sql(sql), tuple(params or ()))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.copy()
+
+        with self.limit.connection() as con:
+            check_select(con, sql)
+            df = con.execute(sql, params or []).fetch_df()
+
+        self.cache.put(key, df)
+        return df.copy()
+
+    def stats(self) -> dict:
+        return {"data_version": self._version, **self.cache.stats()}
+
+    def close(self):
+        self.cache.clear()
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    service: QueryService = None
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _run_query(self, sql: str, params: list):
+        if not sql:
+            self._send_json(400, {"error": "Missing 'sql'"})
+            return
+        try:
+            df = self.service.query(sql, params)
+        except IngestInProgressError as e:
+            self._send_json(503, {"error": str(e)})
+            return
+        except Exception as e:
+            logger.warning(f"Query failed: {e}")
+            self._send_json(400, {"error": str(e)})
+            return
+        result = json.loads(df.to_json(orient="split", index=False, date_format="iso"))
+        self._send_json(200, {"data_version": self.service.stats()["data_version"], **result})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._send_json(200, self.service.stats())
+        elif url.path == "/query":
+            qs = parse_qs(url.query)
+            self._run_query(qs.get("sql", [""])[0], qs.get("param", []))
+        else:
+            self._send_json(404, {"error": f"Unknown path: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/query":
+            self._send_json(404, {"error": f"Unknown path: {url.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON body: {e}"})
+            return
+        self._run_query(payload.get("sql", ""), payload.get("params"))
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def make_server(service: QueryService, host: str = None, port: int = None) -> ThreadingHTTPServer:
+    handler = type("BoundQueryRequestHandler", (QueryRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host or config.QUERY_HOST, config.QUERY_PORT if port is None else port), handler)
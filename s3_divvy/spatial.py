@@ -0,0 +1,156 @@
+import math
+import logging
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Geohash: each character adds 5 bits, alternating longitude/latitude bisections, so a
+# cell id's prefixes are its ancestors (precision 5 ~ 4.9 km, 6 ~ 1.2 km, 7 ~ 150 m)
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+# Upper bound on cells a proximity query prunes with before dropping to a coarser level
+MAX_COVER_CELLS = 32
+
+
+def _bits(precision: int):
+    total = 5 * precision
+    return (total + 1) // 2, total // 2  # longitude bits, latitude bits
+
+
+def _cell_size(precision: int):
+    lng_bits, lat_bits = _bits(precision)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def encode_geohash(lat: float, lng: float, precision: int) -> str:
+    lng_bits, lat_bits = _bits(precision)
+    lat_idx = min(int((lat + 90.0) / 180.0 * 2 ** lat_bits), 2 ** lat_bits - 1)
+    lng_idx = min(int((lng + 180.0) / 360.0 * 2 ** lng_bits), 2 ** lng_bits - 1)
+
+    cell = []
+    for k in range(precision):
+        value = 0
+        for b in range(5):
+            i = 5 * k + b
+            if i % 2 == 0:
+                bit = (lng_idx >> (lng_bits - 1 - i // 2)) & 1
+            else:
+                bit = (lat_idx >> (lat_bits - 1 - i // 2)) & 1
+            value = (value << 1) | bit
+        cell.append(GEOHASH_ALPHABET[value])
+    return "".join(cell)
+
+
+def geohash_sql(lat_expr: str, lng_expr: str, precision: int) -> str:
+    """SQL expression for the geohash of DOUBLE lat/lng expressions; NULL when out of range.
+
+    Same bit interleaving as encode_geohash, unrolled into shifts and masks so DuckDB
+    evaluates it vector-at-a-time with no Python in the loop.
+    """
+    lng_bits, lat_bits = _bits(precision)
+    lat_idx = f"LEAST(CAST(floor(({lat_expr} + 90.0) / 180.0 * {2 ** lat_bits}) AS BIGINT), {2 ** lat_bits - 1})"
+    lng_idx = f"LEAST(CAST(floor(({lng_expr} + 180.0) / 360.0 * {2 ** lng_bits}) AS BIGINT), {2 ** lng_bits - 1})"
+
+    chars = []
+    for k in range(precision):
+        terms = []
+        for b in range(5):
+            i = 5 * k + b
+            if i % 2 == 0:
+                source, shift = lng_idx, lng_bits - 1 - i // 2
+            else:
+                source, shift = lat_idx, lat_bits - 1 - i // 2
+            terms.append(f"((({source} >> {shift}) & 1) << {4 - b})")
+        # Bitwise and concat operators share one precedence level in DuckDB; parenthesize all
+        chars.append(f"(substr('{GEOHASH_ALPHABET}', 1 + CAST(({' | '.join(terms)}) AS INTEGER), 1))")
+
+    valid = f"{lat_expr} BETWEEN -90 AND 90 AND {lng_expr} BETWEEN -180 AND 180"
+    return f"CASE WHEN {valid} THEN ({' || '.join(chars)}) END"
+
+
+def haversine_sql(lat1: str, lng1: str, lat2: str, lng2: str) -> str:
+    # Great-circle distance in km between DOUBLE degree expressions, as one columnar expression
+    lat1, lng1, lat2, lng2 = (f"radians({e})" for e in (lat1, lng1, lat2, lng2))
+    return (
+        f"2 * {EARTH_RADIUS_KM} * asin(sqrt("
+        f"pow(sin(({lat2} - {lat1}) / 2), 2)"
+        f" + cos({lat1}) * cos({lat2}) * pow(sin(({lng2} - {lng1}) / 2), 2)))"
+    )
+
+
+def cover_cells(lat_min: float, lng_min: float, lat_max: float, lng_max: float, max_precision: int = None):
+    """Finest geohash cells (at most MAX_COVER_CELLS) covering a bounding box: (precision, cells)."""
+    max_precision = max_precision or config.SPATIAL_CELL_PRECISION
+    for precision in range(max_precision, 0, -1):
+        lat_step, lng_step = _cell_size(precision)
+        lat_cells = math.floor((lat_max + 90.0) / lat_step) - math.floor((lat_min + 90.0) / lat_step) + 1
+        lng_cells = math.floor((lng_max + 180.0) / lng_step) - math.floor((lng_min + 180.0) / lng_step) + 1
+        if lat_cells * lng_cells <= MAX_COVER_CELLS or precision == 1:
+            break
+
+    cells = set()
+    for i in range(lat_cells):
+        lat = min(lat_min + i * lat_step, lat_max)
+        for j in range(lng_cells):
+            lng = min(lng_min + j * lng_step, lng_max)
+            cells.add(encode_geohash(lat, lng, precision))
+    # Stepping from the box's corner can miss the last row/column of cells
+    for lat in (lat_min, lat_max):
+        for lng in (lng_min, lng_max):
+            cells.add(encode_geohash(lat, lng, precision))
+    return precision, sorted(cells)
+
+
+def near_query_sql(lat: float, lng: float, radius_km: float, endpoint: str = "start", select: str = "*") -> str:
+    """Trips whose start (or end) lies within radius_km of a point.
+
+    Rows are first pruned by their stored cell id, so the exact haversine only runs on
+    trips from the handful of cells around the point.
+    """
+    if endpoint not in ("start", "end"):
+        raise ValueError(f"endpoint must be 'start' or 'end', not {endpoint!r}")
+
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    precision, cells = cover_cells(lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+
+    cell_list = ", ".join(f"'{c}'" for c in cells)
+    distance = haversine_sql(
+        f"TRY_CAST({endpoint}_lat AS DOUBLE)", f"TRY_CAST({endpoint}_lng AS DOUBLE)",
+        f"CAST({float(lat)} AS DOUBLE)", f"CAST({float(lng)} AS DOUBLE)",
+    )
+    return f"""
+        SELECT {select}
+        FROM trips
+        WHERE left({endpoint}_cell, {precision}) IN ({cell_list})
+          AND {distance} <= {float(radius_km)}
+    """
+
+
+def trips_near(service, lat: float, lng: float, radius_km: float, endpoint: str = "start", select: str = "*"):
+    # Runs through the query service so repeated map views come from its cache
+    return service.query(near_query_sql(lat, lng, radius_km, endpoint, select))
+
+
+def od_table_name(precision: int) -> str:
+    return f"trips_od_p{precision}"
+
+
+def refresh_od_aggregates(con, precisions: list = None):
+    """Rebuild the cell-level origin-destination tables, one per zoom precision."""
+    precisions = precisions or config.SPATIAL_OD_PRECISIONS
+    for precision in precisions:
+        table_name = od_table_name(precision)
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {table_name} AS
+            SELECT
+                left(start_cell, {precision}) AS start_cell,
+                left(end_cell, {precision}) AS end_cell,
+                COUNT(*) AS trip_count,
+                AVG(ride_length_sec) AS avg_ride_length_sec,
+                AVG(ride_distance_km) AS avg_ride_distance_km
+            FROM trips
+            WHERE start_cell IS NOT NULL AND end_cell IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        logger.info(f"Refreshed OD aggregate table: {table_name}")
@@ -0,0 +1,110 @@
+import os
+import csv
+import time
+import logging
+import pandas as pd
+from datetime import datetime, timezone
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Per-file state machine, in order; a file resumes from the stage after its last "done" row
+STAGES = ["listed", "downloaded", "verified", "extracted", "ingested"]
+
+FIELDNAMES = [
+    "file_name", "last_modified", "stage",
+    "status", "attempts", "error", "recorded_at"
+]
+
+def _version(last_modified) -> str:
+    # Listings carry last_modified as ISO strings or parsed timestamps; journal one form
+    return pd.Timestamp(last_modified).isoformat()
+
+def record_stage(file_name: str, last_modified: str, stage: str, status: str = "done",
+                 attempts: int = 1, error: str = ""):
+    journal_path = config.STAGE_JOURNAL_PATH  # dynamically access current value
+    is_new_file = not os.path.exists(journal_path)
+
+    with open(journal_path, "a", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+
+        if is_new_file:
+            writer.writeheader()
+
+        writer.writerow({
+            "file_name": file_name,
+            "last_modified": _version(last_modified),
+            "stage": stage,
+            "status": status,
+            "attempts": attempts,
+            "error": error,
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+        # The journal is only useful if a crash right after this call can't lose the row
+        csvfile.flush()
+        os.fsync(csvfile.fileno())
+
+def load_state() -> dict:
+    """Last completed stage per file: {file_name: {"stage": ..., "last_modified": ...}}."""
+    journal_path = config.STAGE_JOURNAL_PATH
+    state = {}
+    if not os.path.exists(journal_path):
+        return state
+
+    with open(journal_path, newline="") as csvfile:
+        for row in csv.DictReader(csvfile):
+            # A crash mid-write can leave a truncated last line; skip anything unrecognisable
+            if row.get("stage") not in STAGES or row.get("status") != "done":
+                continue
+            state[row["file_name"]] = {
+                "stage": row["stage"],
+                "last_modified": row["last_modified"],
+            }
+    return state
+
+def completed_stage(state: dict, file_name: str, last_modified: str):
+    # A file re-published upstream starts over from scratch
+    entry = state.get(file_name)
+    if entry is None or entry["last_modified"] != _version(last_modified):
+        return None
+    return entry["stage"]
+
+def is_done(state: dict, file_name: str, last_modified: str, stage: str) -> bool:
+    done = completed_stage(state, file_name, last_modified)
+    return done is not None and STAGES.index(done) >= STAGES.index(stage)
+
+def pending_files(state: dict, current_df):
+    """Rows of the current listing whose journal shows an unfinished pipeline."""
+    mask = [
+        row["file_name"] in state
+        and not is_done(state, row["file_name"], row["last_modified"], "ingested")
+        for _, row in current_df.iterrows()
+    ]
+    return current_df[mask]
+
+def run_with_retries(stage: str, file_name: str, last_modified: str, func, *args,
+                     attempts: int = None, backoff_sec: float = None):
+    """Call func until it returns a truthy value, backing off exponentially between tries.
+
+    Success is journaled as a "done" row; exhausting the attempts journals a "failed" row
+    and returns None so the file is picked up again on the next run.
+    """
+    attempts = attempts or config.STAGE_MAX_ATTEMPTS
+    backoff_sec = config.STAGE_BACKOFF_SEC if backoff_sec is None else backoff_sec
+    error = ""
+
+    for attempt in range(1, attempts + 1):
+        try:
+            result = func(*args)
+            if result:
+                record_stage(file_name, last_modified, stage, "done", attempt)
+                return result
+            error = "returned no result"
+        except Exception as e:
+            error = str(e)
+        logger.warning(f"{stage} failed for {file_name} (attempt {attempt}/{attempts}): {error}")
+        if attempt < attempts:
+            time.sleep(backoff_sec * 2 ** (attempt - 1))
+
+    record_stage(file_name, last_modified, stage, "failed", attempts, error)
+    return None
@@ -0,0 +1,26 @@
+import logging
+import argparse
+
+from s3_divvy import derived, governor, spatial
+
+logging.basicConfig(level=logging.INFO)
+
+
+def run(recompute=False):
+    con = governor.database_connection()
+    try:
+        updated = derived.backfill_trips(con, recompute=recompute)
+        logging.info(f"Derived columns backfilled on {updated} rows")
+        if updated:
+            spatial.refresh_od_aggregates(con)
+        return updated
+    finally:
+        governor.close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill derived metric and grid cell columns on existing trips rows")
+    parser.add_argument("--recompute", action="store_true", help="Recompute every row, not just rows missing metrics")
+    args = parser.parse_args()
+
+    run(recompute=args.recompute)
@@ -3,19 +3,95 @@ import os
 import logging
 import argparse
 from datetime import datetime, timezone
-import duckdb
+import pandas as pd
 
-from s3_divvy import core, metadata, processing, ingestion_log
-from s3_divvy.config import EXTRACT_DIR, QUALITY_CHECK_MODE, DUCKDB_PATH
+from s3_divvy import core, metadata, processing, ingestion_log, governor, stage_journal, spatial, data_version
+from s3_divvy.config import EXTRACT_DIR, QUALITY_CHECK_MODE
 
 logging.basicConfig(level=logging.INFO)
 
 
-def find_first_csv(directory):
-    for fname in os.listdir(directory):
-        if fname.lower().endswith(".csv"):
-            return os.path.join(directory, fname)
-    return None
+def find_trip_members(extract_path):
+    # Every trip CSV extracted from the archive, in a stable order; station files and junk are skipped
+    trip_paths = []
+    for member_name, kind in core.list_extracted_members(extract_path):
+        if kind == "trip":
+            trip_paths.append(os.path.join(extract_path, member_name))
+        elif kind == "station":
+            logging.info(f"Skipping station file {member_name}")
+    return trip_paths
+
+
+def verify_download(zip_path):
+    return core.verify_zip(zip_path) and core.save_file_hash(zip_path)
+
+
+def extract_file(zip_path, extract_path):
+    os.makedirs(extract_path, exist_ok=True)
+    return core.extract_zip(zip_path, extract_path)
+
+
+def prepare_file(file_name, last_modified, state):
+    # Download -> verify -> extract, resuming after the last journaled stage
+    zip_path = os.path.join(core.DOWNLOAD_DIR, file_name)
+    extract_path = os.path.join(EXTRACT_DIR, file_name.replace(".zip", ""))
+
+    if stage_journal.completed_stage(state, file_name, last_modified) is None:
+        if file_name in state and os.path.exists(zip_path):
+            # Re-published upstream: the local copy is stale
+            os.remove(zip_path)
+        stage_journal.record_stage(file_name, last_modified, "listed")
+
+    if not stage_journal.is_done(state, file_name, last_modified, "downloaded"):
+        zip_path = stage_journal.run_with_retries(
+            "downloaded", file_name, last_modified, core.download_file, file_name
+        )
+        if not zip_path:
+            return False
+
+    if not stage_journal.is_done(state, file_name, last_modified, "verified"):
+        # A corrupt archive won't fix itself on retry; drop it so the next run re-downloads
+        if not stage_journal.run_with_retries(
+            "verified", file_name, last_modified, verify_download, zip_path, attempts=1
+        ):
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            stage_journal.record_stage(file_name, last_modified, "listed")
+            return False
+
+    if not stage_journal.is_done(state, file_name, last_modified, "extracted"):
+        if not stage_journal.run_with_retries(
+            "extracted", file_name, last_modified, extract_file, zip_path, extract_path
+        ):
+            return False
+
+    return True
+
+
+def ingest_members(csv_paths, archive_name, mode, qc_mode, results):
+    # Fills results per member; succeeds only when every trip member was loaded
+    results.clear()
+    if mode == "duckdb":
+        results.update(processing.process_csv_members(csv_paths, archive_name, quality_check=qc_mode))
+    else:
+        for csv_path in csv_paths:
+            result = processing.process_csv_file(csv_path, mode=mode, quality_check=qc_mode)
+            # Pandas mode returns the loaded DataFrame rather than True; only None is a failure
+            results[os.path.basename(csv_path).replace(".csv", "")] = {
+                "status": "success" if result is not None else "failed",
+                "inserted_rows": len(result) if isinstance(result, pd.DataFrame) else 0,
+                "reject_count": 0
+            }
+    return len(results) == len(csv_paths) and all(r["status"] == "success" for r in results.values())
+
+
+def refresh_spatial_aggregates():
+    # Cell-level OD tables are rebuilt once per run rather than once per file
+    try:
+        spatial.refresh_od_aggregates(governor.database_connection())
+        data_version.bump_data_version()
+    except Exception as e:
+        logging.error(f"Failed to refresh OD aggregates: {e}")
 
 
 def run(mode="duckdb", quality_check=None):
@@ -26,21 +102,29 @@ def run(mode="duckdb", quality_check=None):
         return
 
     previous_df = metadata.load_metadata()
-    files_to_process = metadata.compare_metadata(current_df, previous_df)
+    state = stage_journal.load_state()
 
-    for _, row in files_to_process.iterrows():
-        file_name = row["file_name"]
-        zip_path = core.download_file(file_name)
-        if not zip_path:
-            continue
+    # New/updated files plus anything a previous run left part-way through
+    files_to_process = pd.concat(
+        [metadata.compare_metadata(current_df, previous_df), stage_journal.pending_files(state, current_df)],
+        ignore_index=True,
+    ).drop_duplicates(subset="file_name")
 
-        extract_path = os.path.join(EXTRACT_DIR, file_name.replace(".zip", ""))
-        os.makedirs(extract_path, exist_ok=True)
-        core.extract_zip(zip_path, extract_path)
-        core.save_file_hash(zip_path)
+    for _, row in files_to_process.iterrows():
+        prepare_file(row["file_name"], row["last_modified"], state)
 
+    # Safe to save now: unfinished files stay pending in the stage journal
     metadata.save_metadata(current_df)
 
+    state = stage_journal.load_state()
+    ready = [
+        row for _, row in files_to_process.iterrows()
+        if stage_journal.is_done(state, row["file_name"], row["last_modified"], "extracted")
+        and not stage_journal.is_done(state, row["file_name"], row["last_modified"], "ingested")
+    ]
+    # Whether any rows reached 'trips' this run (a partly failed archive still counts)
+    any_ingested = False
+
     if mode == "bulk":
         start_dt = datetime.now(timezone.utc)
         result = processing.process_csv_file("", mode="bulk")
@@ -58,52 +142,72 @@ def run(mode="duckdb", quality_check=None):
             "reject_count": ""
         })
 
+        if result:
+            any_ingested = True
+            for row in ready:
+                stage_journal.record_stage(row["file_name"], row["last_modified"], "ingested")
+
     else:
-        for _, row in files_to_process.iterrows():
+        for row in ready:
             file_name = row["file_name"]
             extract_path = os.path.join(EXTRACT_DIR, file_name.replace(".zip", ""))
-            csv_path = find_first_csv(extract_path)
-            if not csv_path:
-                logging.warning(f"No CSV found in {extract_path}, skipping")
+            if not os.path.isdir(extract_path):
+                # Extracted files were cleaned up since; start over so the next run re-downloads
+                logging.warning(f"Extracted files for {file_name} are missing, resetting it to listed")
+                stage_journal.record_stage(file_name, row["last_modified"], "listed")
                 continue
 
             start_dt = datetime.now(timezone.utc)
-            result = processing.process_csv_file(csv_path, mode=mode, quality_check=qc_mode)
-            end_dt = datetime.now(timezone.utc)
+            csv_paths = find_trip_members(extract_path)
+            if not csv_paths:
+                # e.g. a station-only archive: nothing to load, but the file is finished
+                logging.info(f"No trip CSV found in {file_name}, nothing to ingest")
+                stage_journal.record_stage(file_name, row["last_modified"], "ingested")
+                ingestion_log.log_ingestion_entry({
+                    "file_name": file_name,
+                    "mode": mode,
+                    "quality_check": qc_mode,
+                    "start_time": start_dt.isoformat(timespec="seconds"),
+                    "end_time": start_dt.isoformat(timespec="seconds"),
+                    "duration_sec": 0.0,
+                    "status": "skipped",
+                    "inserted_rows": 0,
+                    "reject_count": 0
+                })
+                continue
 
-            base_name = os.path.basename(csv_path).replace(".csv", "")
-            table_name = f"t_{base_name.replace('-', '_').replace(' ', '_')}"
-            reject_count = 0
-            inserted_rows = 0
-            status = "success"
-
-            if result is True:
-                with duckdb.connect(DUCKDB_PATH) as con:
-                    inserted_rows = con.execute(f"""
-                        SELECT COUNT(*) FROM trips WHERE source_file = '{base_name}'
-                    """).fetchone()[0]
-
-                    if qc_mode:
-                        try:
-                            reject_count = con.execute("SELECT COUNT(*) FROM rejects").fetchone()[0]
-                            if reject_count > 0:
-                                status = "rejected"
-                        except Exception:
-                            reject_count = 0
-            else:
-                status = "failed"
-
-            ingestion_log.log_ingestion_entry({
-                "file_name": file_name.replace(".zip", ".csv"),
-                "mode": mode,
-                "quality_check": qc_mode,
-                "start_time": start_dt.isoformat(timespec="seconds"),
-                "end_time": end_dt.isoformat(timespec="seconds"),
-                "duration_sec": round((end_dt - start_dt).total_seconds(), 1),
-                "status": status,
-                "inserted_rows": inserted_rows,
-                "reject_count": reject_count
-            })
+            results = {}
+            # Quality-check rejects are deterministic, so only retry in production mode
+            stage_journal.run_with_retries(
+                "ingested", file_name, row["last_modified"], ingest_members,
+                csv_paths, file_name.replace(".zip", ""), mode, qc_mode, results,
+                attempts=1 if qc_mode else None,
+            )
+            end_dt = datetime.now(timezone.utc)
+            any_ingested = any_ingested or any(r["status"] == "success" for r in results.values())
+
+            # One ingestion-log row per trip member
+            for csv_path in csv_paths:
+                base_name = os.path.basename(csv_path).replace(".csv", "")
+                outcome = results.get(base_name, {"status": "failed", "inserted_rows": 0, "reject_count": 0})
+
+                ingestion_log.log_ingestion_entry({
+                    "file_name": os.path.basename(csv_path),
+                    "mode": mode,
+                    "quality_check": qc_mode,
+                    "start_time": start_dt.isoformat(timespec="seconds"),
+                    "end_time": end_dt.isoformat(timespec="seconds"),
+                    "duration_sec": round((end_dt - start_dt).total_seconds(), 1),
+                    "status": outcome["status"],
+                    "inserted_rows": outcome["inserted_rows"],
+                    "reject_count": outcome["reject_count"]
+                })
+
+    if any_ingested and mode in ("duckdb", "bulk"):
+        refresh_spatial_aggregates()
+
+    # Release the write lock so readers (e.g. the query service) can attach
+    governor.close_connection()
 
 
 if __name__ == "__main__":
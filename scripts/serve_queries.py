@@ -0,0 +1,30 @@
+import logging
+import argparse
+
+from s3_divvy import query
+from s3_divvy.config import QUERY_HOST, QUERY_PORT, DUCKDB_PATH
+
+logging.basicConfig(level=logging.INFO)
+
+
+def serve(host=QUERY_HOST, port=QUERY_PORT, db_path=DUCKDB_PATH):
+    service = query.QueryService(db_path=db_path)
+    server = query.make_server(service, host, port)
+    logging.info(f"Serving read-only queries on http://{host}:{port}/query (db: {db_path})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve cached read-only queries over the trips table")
+    parser.add_argument("--host", default=QUERY_HOST, help="Interface to bind")
+    parser.add_argument("--port", type=int, default=QUERY_PORT, help="Port to listen on")
+    parser.add_argument("--db", default=DUCKDB_PATH, help="DuckDB database file")
+    args = parser.parse_args()
+
+    serve(host=args.host, port=args.port, db_path=args.db)
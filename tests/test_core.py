@@ -40,3 +40,11 @@ def test_save_file_hash(tmp_path):
     expected = hashlib.sha256(b"hello world").hexdigest()
     actual = hash_path.read_text().strip()
     assert actual == expected
+
+
+def test_classify_member():
+    assert core.classify_member("202004-divvy-tripdata.csv") == "trip"
+    assert core.classify_member("Divvy_Trips_2019_Q1/Divvy_Trips_2019_Q1.csv") == "trip"
+    assert core.classify_member("Divvy_Stations_2017_Q1Q2.csv") == "station"
+    assert core.classify_member("__MACOSX/._Divvy_Trips_2019_Q1.csv") == "junk"
+    assert core.classify_member("README.txt") == "junk"
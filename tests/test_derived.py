@@ -0,0 +1,68 @@
+import duckdb
+import pytest
+from s3_divvy import derived
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    monkeypatch.setattr(derived.data_version.config, "DATA_VERSION_PATH", str(tmp_path / "data_version.txt"))
+    con = duckdb.connect()
+    yield con
+    con.close()
+
+def test_modern_schema_metrics(con):
+    con.execute("""
+        CREATE TABLE raw AS SELECT
+            '2024-01-07 08:15:00' AS started_at, '2024-01-07 08:45:30' AS ended_at,
+            '41.8781' AS start_lat, '-87.6298' AS start_lng, '41.8881' AS end_lat, '-87.6298' AS end_lng
+    """)
+    row = con.execute(f"SELECT {derived.derived_select(derived.table_columns(con, 'raw'))} FROM raw").fetchone()
+    ride_length, day_of_week, hour_of_day, distance, start_cell, end_cell = row
+    assert ride_length == 1830
+    assert day_of_week == 0  # Sunday
+    assert hour_of_day == 8
+    # 0.01 degrees of latitude is ~1.11 km
+    assert distance == pytest.approx(1.112, abs=0.001)
+    assert start_cell == "dp3wjzt"
+    assert end_cell == "dp3wmcm"
+
+def test_legacy_schema_metrics(con):
+    con.execute("""
+        CREATE TABLE raw AS SELECT
+            '3/31/2017 23:59:07' AS start_time, '4/1/2017 0:14:12' AS end_time, '1,035.0' AS tripduration
+    """)
+    row = con.execute(f"SELECT {derived.derived_select(derived.table_columns(con, 'raw'))} FROM raw").fetchone()
+    assert row == (1035.0, 5, 23, None, None, None)
+
+def test_unparseable_values_become_null(con):
+    con.execute("CREATE TABLE raw AS SELECT 'n/a' AS started_at, '' AS ended_at")
+    row = con.execute(f"SELECT {derived.derived_select(['started_at', 'ended_at'])} FROM raw").fetchone()
+    assert row == (None, None, None, None, None, None)
+
+def test_backfill_existing_trips(con):
+    con.execute("""
+        CREATE TABLE trips AS SELECT * FROM (VALUES
+            ('2024-01-01 10:00:00', '2024-01-01 10:10:00', NULL, '41.87', '-87.62', '41.88', '-87.63', 'a'),
+            (NULL, NULL, '600', NULL, NULL, NULL, NULL, 'b')
+        ) t(started_at, ended_at, tripduration, start_lat, start_lng, end_lat, end_lng, source_file)
+    """)
+    assert derived.backfill_trips(con) == 2
+    rows = con.execute("SELECT source_file, ride_length_sec, start_cell IS NULL FROM trips ORDER BY 1").fetchall()
+    assert rows == [("a", 600.0, False), ("b", 600.0, True)]
+
+    # Rows whose remaining NULLs can't be derived (legacy: no coordinates) are not rewritten
+    version = derived.data_version.get_data_version()
+    assert derived.backfill_trips(con) == 0
+    assert derived.data_version.get_data_version() == version
+    assert derived.backfill_trips(con, recompute=True) == 2
+
+def test_backfill_fills_only_missing_columns(con):
+    con.execute("""
+        CREATE TABLE trips AS SELECT
+            '2024-01-01 10:00:00' AS started_at, '2024-01-01 10:10:00' AS ended_at,
+            '41.87' AS start_lat, '-87.62' AS start_lng, '41.88' AS end_lat, '-87.63' AS end_lng,
+            CAST(42 AS DOUBLE) AS ride_length_sec, 'a' AS source_file
+    """)
+    assert derived.backfill_trips(con) == 1
+    ride_length, start_cell = con.execute("SELECT ride_length_sec, start_cell FROM trips").fetchone()
+    assert ride_length == 42
+    assert start_cell is not None
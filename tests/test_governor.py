@@ -0,0 +1,120 @@
+import duckdb
+import pytest
+from s3_divvy import governor
+
+MIB = governor.MIB
+
+@pytest.fixture
+def host(monkeypatch, tmp_path):
+    def set_host(cpus, memory_mb):
+        monkeypatch.setattr(governor, "host_cpu_count", lambda: cpus)
+        monkeypatch.setattr(governor, "host_memory_bytes", lambda: memory_mb * MIB)
+    monkeypatch.setattr(governor.config, "DUCKDB_MAX_THREADS", 0)
+    monkeypatch.setattr(governor.config, "DUCKDB_MEMORY_LIMIT_MB", 0)
+    monkeypatch.setattr(governor.config, "DUCKDB_MEMORY_FRACTION", 0.6)
+    monkeypatch.setattr(governor.config, "DUCKDB_TEMP_DIR", str(tmp_path / "duckdb_tmp"))
+    return set_host
+
+def test_small_file_gets_few_threads(host):
+    host(cpus=64, memory_mb=256 * 1024)
+    plan = governor.plan_resources(10 * MIB)
+    assert plan["threads"] == 1
+    assert plan["memory_limit"] == "512MiB"
+    assert plan["preserve_insertion_order"] is False
+
+def test_large_file_capped_by_small_host_memory(host):
+    host(cpus=8, memory_mb=4 * 1024)
+    plan = governor.plan_resources(1024 * MIB)
+    # 60% of 4 GiB, and one thread per 256 MiB of that budget
+    assert plan["memory_limit"] == "2457MiB"
+    assert plan["threads"] == 8
+
+    host(cpus=64, memory_mb=4 * 1024)
+    assert governor.plan_resources(1024 * MIB)["threads"] == 9
+
+def test_large_file_on_big_host_uses_cores(host):
+    host(cpus=64, memory_mb=256 * 1024)
+    plan = governor.plan_resources(4096 * MIB)
+    assert plan["threads"] == 64
+
+def test_env_overrides(host, monkeypatch):
+    host(cpus=64, memory_mb=256 * 1024)
+    monkeypatch.setattr(governor.config, "DUCKDB_MAX_THREADS", 4)
+    monkeypatch.setattr(governor.config, "DUCKDB_MEMORY_LIMIT_MB", 1024)
+    plan = governor.plan_resources(4096 * MIB)
+    assert plan["threads"] == 4
+    assert plan["memory_limit"] == "1024MiB"
+
+def test_apply_plan_sets_duckdb_settings(host):
+    host(cpus=2, memory_mb=4 * 1024)
+    con = duckdb.connect()
+    governor.apply_plan(con, governor.plan_resources(64 * MIB))
+    threads, order = con.execute(
+        "SELECT current_setting('threads'), current_setting('preserve_insertion_order')"
+    ).fetchone()
+    assert threads == 2
+    assert order is False
+    con.close()
+
+def test_connection_reused_until_path_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(governor.config, "DUCKDB_PATH", str(tmp_path / "a.duckdb"))
+    first = governor.get_connection()
+    assert governor.get_connection() is first
+
+    monkeypatch.setattr(governor.config, "DUCKDB_PATH", str(tmp_path / "b.duckdb"))
+    assert governor.get_connection() is not first
+    governor.close_connection()
+
+def test_database_connection_sized_for_whole_table(host, tmp_path, monkeypatch):
+    host(cpus=64, memory_mb=256 * 1024)
+    db_path = tmp_path / "a.duckdb"
+    monkeypatch.setattr(governor.config, "DUCKDB_PATH", str(db_path))
+
+    # The shared connection was last tuned for a tiny member file
+    governor.governed_connection(1 * MIB)
+    with open(db_path, "r+b") as f:
+        f.truncate(1024 * MIB)
+
+    con = governor.database_connection()
+    threads = con.execute("SELECT current_setting('threads')").fetchone()[0]
+    assert threads == governor.plan_resources(1024 * MIB)["threads"] == 16
+    governor.close_connection()
+
+def test_dialect_sniffed_once_per_schema_era(tmp_path, monkeypatch):
+    header = "ride_id;started_at\n"
+    first = tmp_path / "202301.csv"
+    second = tmp_path / "202302.csv"
+    first.write_text(header + "A1;2023-01-01\n")
+    second.write_text(header + "B1;2023-02-01\nB2;2023-02-02\n")
+
+    governor.clear_dialect_cache()
+    con = duckdb.connect()
+    dialect = governor.sniff_dialect(con, str(first))
+    assert dialect["delim"] == ";"
+    assert dialect["columns"] == ["ride_id", "started_at"]
+
+    # A second file from the same era must not hit the sniffer again
+    assert governor.sniff_dialect(duckdb.connect(), str(second)) is dialect
+
+    rows = con.execute(
+        f"SELECT * FROM read_csv('{second}', {governor.dialect_options(dialect)})"
+    ).fetchall()
+    assert rows == [("B1", "2023-02-01"), ("B2", "2023-02-02")]
+    con.close()
+    governor.clear_dialect_cache()
+
+def test_cached_dialect_keeps_rfc_quoting(tmp_path):
+    plain = tmp_path / "plain.csv"
+    quoted = tmp_path / "quoted.csv"
+    plain.write_text("ride_id,start_station_name\nA1,Clark St\n")
+    quoted.write_text('ride_id,start_station_name\nB1,"Clark St, Lake St"\n')
+
+    governor.clear_dialect_cache()
+    con = duckdb.connect()
+    dialect = governor.sniff_dialect(con, str(plain))
+    rows = con.execute(
+        f"SELECT * FROM read_csv('{quoted}', {governor.dialect_options(dialect)})"
+    ).fetchall()
+    assert rows == [("B1", "Clark St, Lake St")]
+    con.close()
+    governor.clear_dialect_cache()
@@ -17,7 +17,11 @@ A2,electric_bike,2025-01-02 12:00,2025-01-02 12:20,Station C,STA002,Station D,ST
 def duckdb_path(tmp_path, monkeypatch):
     db_path = tmp_path / "test.duckdb"
     monkeypatch.setattr(processing.config, "DUCKDB_PATH", str(db_path))
-    return db_path
+    monkeypatch.setattr(processing.config, "DATA_VERSION_PATH", str(tmp_path / "data_version.txt"))
+    monkeypatch.setattr(processing.config, "DUCKDB_TEMP_DIR", str(tmp_path / "duckdb_tmp"))
+    yield db_path
+    processing.governor.close_connection()
+    processing.governor.clear_dialect_cache()
 
 def test_duckdb_mode_creates_table(sample_csv, duckdb_path):
     table_name = sample_csv.stem.replace("-", "_")
@@ -86,6 +90,88 @@ def test_bulk_mode_rejects_quality_check(tmp_path, duckdb_path):
     success = processing.process_csv_file("", mode="bulk", quality_check=True)
     assert success is None
 
+def test_duckdb_mode_bumps_data_version(sample_csv, duckdb_path):
+    from s3_divvy import data_version
+    assert data_version.get_data_version() == 0
+    processing.process_csv_file(str(sample_csv), mode="duckdb", quality_check=False)
+    assert data_version.get_data_version() == 1
+
+def test_process_csv_members_keeps_per_member_lineage(tmp_path, duckdb_path):
+    header = "ride_id,started_at\n"
+    q1 = tmp_path / "Divvy_Trips_2019_Q1.csv"
+    q2 = tmp_path / "Divvy_Trips_2019_Q2.csv"
+    q1.write_text(header + "X1,2019-01-01\nX2,2019-01-02\n")
+    q2.write_text(header + "Y1,2019-04-01\n")
+
+    results = processing.process_csv_members([str(q1), str(q2)], "Divvy_Trips_2019", quality_check=False)
+    assert results["Divvy_Trips_2019_Q1"]["inserted_rows"] == 2
+    assert results["Divvy_Trips_2019_Q2"]["inserted_rows"] == 1
+
+    con = duckdb.connect(str(duckdb_path))
+    result = con.execute("SELECT source_file, COUNT(*) FROM trips GROUP BY 1 ORDER BY 1").fetchall()
+    assert result == [("Divvy_Trips_2019_Q1", 2), ("Divvy_Trips_2019_Q2", 1)]
+    con.close()
+
+def test_partial_failure_keeps_committed_results(tmp_path, duckdb_path, monkeypatch):
+    from s3_divvy import data_version
+    q1 = tmp_path / "Divvy_Trips_2019_Q1.csv"
+    q2 = tmp_path / "Divvy_Trips_2019_Q2.csv"
+    q1.write_text("ride_id,started_at\nX1,2019-01-01\n")
+    q2.write_text("trip_id,start_time\nY1,2019-04-01\n")
+
+    # The first era commits, then the second era's schema step fails
+    real_ensure = processing.derived.ensure_trips_columns
+    calls = []
+    def failing_ensure(con, columns):
+        calls.append(columns)
+        if len(calls) > 1:
+            raise RuntimeError("disk full")
+        real_ensure(con, columns)
+    monkeypatch.setattr(processing.derived, "ensure_trips_columns", failing_ensure)
+
+    results = processing.process_csv_members([str(q1), str(q2)], "Divvy_Trips_2019", quality_check=False)
+    assert results["Divvy_Trips_2019_Q1"] == {"status": "success", "inserted_rows": 1, "reject_count": 0}
+    assert results["Divvy_Trips_2019_Q2"]["status"] == "failed"
+    assert data_version.get_data_version() == 1
+
+def test_process_csv_members_holds_back_rejected_member(tmp_path, duckdb_path):
+    good = tmp_path / "good.csv"
+    bad = tmp_path / "bad.csv"
+    good.write_text("id,value\n1,good\n")
+    bad.write_text("id,value\n2,good\n\"UNTERMINATED\n")
+
+    results = processing.process_csv_members([str(good), str(bad)], "archive", quality_check=True)
+    assert results["good"]["status"] == "success"
+    assert results["bad"]["status"] == "rejected"
+    assert results["bad"]["reject_count"] > 0
+
+def test_duckdb_mode_adds_derived_columns(sample_csv, duckdb_path):
+    processing.process_csv_file(str(sample_csv), mode="duckdb", quality_check=False)
+
+    con = duckdb.connect(str(duckdb_path))
+    result = con.execute("""
+        SELECT ride_length_sec, day_of_week, hour_of_day, ride_distance_km FROM trips ORDER BY ride_id
+    """).fetchall()
+    assert result[0][:3] == (600.0, 3, 10)
+    assert result[1][:3] == (1200.0, 4, 12)
+    assert all(row[3] > 0 for row in result)
+    con.close()
+
+def test_legacy_era_appends_to_modern_trips(sample_csv, tmp_path, duckdb_path):
+    legacy_csv = tmp_path / "Divvy_Trips_2019_Q1.csv"
+    legacy_csv.write_text("trip_id,start_time,end_time,tripduration,usertype\n1,2019-01-01 00:04:37,2019-01-01 00:11:07,390.0,Subscriber\n")
+
+    processing.process_csv_file(str(sample_csv), mode="duckdb", quality_check=False)
+    assert processing.process_csv_file(str(legacy_csv), mode="duckdb", quality_check=False) is True
+
+    con = duckdb.connect(str(duckdb_path))
+    row = con.execute("""
+        SELECT ride_id, trip_id, usertype, ride_length_sec, hour_of_day
+        FROM trips WHERE source_file = 'Divvy_Trips_2019_Q1'
+    """).fetchone()
+    assert row == (None, "1", "Subscriber", 390.0, 0)
+    con.close()
+
 def test_pandas_mode(sample_csv):
     df = processing.process_csv_file(str(sample_csv), mode="pandas")
     assert isinstance(df, pd.DataFrame)
@@ -0,0 +1,140 @@
+import sys
+import json
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+import duckdb
+import pytest
+from s3_divvy import query, data_version
+
+@pytest.fixture
+def trips_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(query.config, "DATA_VERSION_PATH", str(tmp_path / "data_version.txt"))
+    db_path = tmp_path / "test.duckdb"
+    con = duckdb.connect(str(db_path))
+    con.execute("""
+        CREATE TABLE trips AS
+        SELECT * FROM (VALUES ('A1', 'member'), ('A2', 'casual'), ('A3', 'member')) t(ride_id, member_casual)
+    """)
+    con.close()
+    return db_path
+
+@pytest.fixture
+def service(trips_db):
+    svc = query.QueryService(db_path=str(trips_db), max_concurrent=2)
+    yield svc
+    svc.close()
+
+def test_normalize_sql_folds_whitespace_and_case_but_not_literals():
+    a = query.normalize_sql("SELECT  *\n FROM trips WHERE member_casual = 'Member';")
+    b = query.normalize_sql("select * from trips where member_casual = 'Member'")
+    assert a == b
+    assert query.normalize_sql("select 'A  B'") != query.normalize_sql("select 'a b'")
+
+def test_repeated_query_served_from_cache(service):
+    sql = "SELECT member_casual, COUNT(*) AS n FROM trips GROUP BY 1 ORDER BY 1"
+    first = service.query(sql)
+    second = service.query("select member_casual, count(*) as n\nfrom trips group by 1 order by 1")
+
+    assert first.equals(second)
+    stats = service.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_connections_are_read_only(service):
+    with service.limit.connection() as con, pytest.raises(duckdb.Error):
+        con.execute("DELETE FROM trips")
+
+def test_only_single_select_is_allowed(service):
+    with pytest.raises(ValueError):
+        service.query("SELECT 1; SELECT 2")
+    with pytest.raises(ValueError):
+        service.query("COPY trips TO 'trips.csv'")
+
+def test_external_access_is_disabled(service, tmp_path):
+    csv_path = tmp_path / "secret.csv"
+    csv_path.write_text("a\n1\n")
+    with pytest.raises(duckdb.PermissionException):
+        service.query(f"SELECT * FROM read_csv('{csv_path}')")
+
+def test_data_version_bump_invalidates_cache(service, trips_db):
+    sql = "SELECT COUNT(*) AS n FROM trips"
+    assert service.query(sql)["n"][0] == 3
+
+    # Ingest runs in another process and needs DuckDB's write lock while the service is up
+    writer = (
+        "import duckdb, sys; con = duckdb.connect(sys.argv[1]); "
+        "con.execute(\"INSERT INTO trips VALUES ('A4', 'casual')\"); con.close()"
+    )
+    subprocess.run([sys.executable, "-c", writer, str(trips_db)], check=True, timeout=60)
+    data_version.bump_data_version()
+
+    assert service.query(sql)["n"][0] == 4
+    assert service.stats()["data_version"] == 1
+
+def test_cache_miss_during_ingest_reports_it(service, trips_db):
+    sql = "SELECT COUNT(*) AS n FROM trips"
+    service.query(sql)
+
+    # A second process holds the write lock for the length of an ingest
+    writer = (
+        "import duckdb, sys; con = duckdb.connect(sys.argv[1]); "
+        "print('locked', flush=True); sys.stdin.read()"
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", writer, str(trips_db)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert proc.stdout.readline().strip() == "locked"
+        assert service.query(sql)["n"][0] == 3
+        with pytest.raises(query.IngestInProgressError):
+            service.query("SELECT ride_id FROM trips")
+    finally:
+        proc.communicate(timeout=60)
+
+def test_cache_evicts_least_recently_used():
+    cache = query.ResultCache(max_entries=2, max_bytes=10**9)
+    df = duckdb.sql("SELECT 1 AS a").df()
+    cache.put("a", df)
+    cache.put("b", df)
+    cache.get("a")
+    cache.put("c", df)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_http_endpoint_returns_json(service):
+    server = query.make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        sql = quote("SELECT ride_id FROM trips WHERE member_casual = ? ORDER BY 1")
+        with urllib.request.urlopen(f"http://{host}:{port}/query?sql={sql}&param=member") as resp:
+            payload = json.loads(resp.read())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert payload["columns"] == ["ride_id"]
+    assert payload["data"] == [["A1"], ["A3"]]
+
+def test_http_endpoint_rejects_non_select(service):
+    server = query.make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        body = json.dumps({"sql": "DROP TABLE trips"}).encode("utf-8")
+        request = urllib.request.Request(f"http://{host}:{port}/query", data=body, method="POST")
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(request)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert excinfo.value.code == 400
@@ -1,11 +1,52 @@
 ### test_run_pipeline.py
 import os
+import zipfile
+import duckdb
 import pytest
 import pandas as pd
 from pathlib import Path
 from datetime import datetime, timezone
 import scripts.run_pipeline as run_pipeline
-from s3_divvy import metadata, core, ingestion_log, config
+from s3_divvy import metadata, core, ingestion_log, config, processing, governor, stage_journal
+
+@pytest.fixture
+def pipeline_env(tmp_path, monkeypatch):
+    # Redirect every pipeline path into tmp_path; call with {zip_name: {member_name: text}}
+    # to list those archives in a fake bucket. Returns the names actually downloaded.
+    zip_dir = tmp_path / "zip"
+    zip_dir.mkdir()
+    monkeypatch.setattr(metadata, "METADATA_PATH", str(tmp_path / "file_metadata.csv"))
+    monkeypatch.setattr(core, "DOWNLOAD_DIR", str(zip_dir))
+    monkeypatch.setattr(core, "HASH_DIR", str(tmp_path))
+    monkeypatch.setattr(run_pipeline, "EXTRACT_DIR", str(tmp_path / "csv"))
+    monkeypatch.setattr(config, "INGESTION_LOG_PATH", str(tmp_path / "file_ingestion_log.csv"))
+    monkeypatch.setattr(config, "STAGE_JOURNAL_PATH", str(tmp_path / "file_stage_journal.csv"))
+    monkeypatch.setattr(config, "STAGE_BACKOFF_SEC", 0)
+    monkeypatch.setattr(config, "DATA_VERSION_PATH", str(tmp_path / "data_version.txt"))
+    monkeypatch.setattr(config, "DUCKDB_PATH", str(tmp_path / "test.duckdb"))
+    monkeypatch.setattr(config, "DUCKDB_TEMP_DIR", str(tmp_path / "duckdb_tmp"))
+    downloads = []
+
+    def serve(archives):
+        monkeypatch.setattr(core, "list_s3_files", lambda: pd.DataFrame({
+            "file_name": list(archives),
+            "size": [1234] * len(archives),
+            "last_modified": ["2024-02-01T00:00:00+00:00"] * len(archives)
+        }))
+
+        def fake_download(file_name):
+            downloads.append(file_name)
+            path = zip_dir / file_name
+            with zipfile.ZipFile(path, "w") as zf:
+                for member_name, text in archives[file_name].items():
+                    zf.writestr(member_name, text)
+            return str(path)
+        monkeypatch.setattr(core, "download_file", fake_download)
+        return downloads
+
+    yield serve
+    governor.close_connection()
+    governor.clear_dialect_cache()
 
 @pytest.fixture
 def sample_metadata(tmp_path):
@@ -28,6 +69,7 @@ def test_pipeline_runs(monkeypatch, tmp_path, sample_metadata):
     # Force log path to temp dir
     log_path = tmp_path / "file_ingestion_log.csv"
     monkeypatch.setattr("s3_divvy.config.INGESTION_LOG_PATH", str(log_path))
+    monkeypatch.setattr("s3_divvy.config.STAGE_JOURNAL_PATH", str(tmp_path / "file_stage_journal.csv"))
 
     # Simulate listing files in S3
     monkeypatch.setattr(core, "list_s3_files", lambda: pd.DataFrame({
@@ -87,4 +129,138 @@ def test_pipeline_runs(monkeypatch, tmp_path, sample_metadata):
     log_df = pd.read_csv(log_path)
     assert not log_df.empty
     assert "file_name" in log_df.columns
-    assert log_df.iloc[0]["file_name"] == "dummy.csv"
\ No newline at end of file
+    assert log_df.iloc[0]["file_name"] == "dummy.csv"
+
+def test_rerun_resumes_after_failed_ingest(monkeypatch, tmp_path, pipeline_env):
+    downloads = pipeline_env({"202401-divvy-tripdata.zip": {
+        "202401-divvy-tripdata.csv": "ride_id,started_at\nA1,2024-01-01\nA2,2024-01-02\n"
+    }})
+
+    real_process = processing.process_csv_members
+    def crashing_process(*args, **kwargs):
+        raise RuntimeError("worker died")
+    monkeypatch.setattr(run_pipeline.processing, "process_csv_members", crashing_process)
+
+    refreshes = []
+    real_refresh = run_pipeline.refresh_spatial_aggregates
+    monkeypatch.setattr(run_pipeline, "refresh_spatial_aggregates", lambda: refreshes.append(real_refresh()))
+
+    run_pipeline.run(mode="duckdb", quality_check=False)
+    state = stage_journal.load_state()
+    assert state["202401-divvy-tripdata.zip"]["stage"] == "extracted"
+    # Nothing was ingested, so the OD tables are left alone
+    assert refreshes == []
+
+    # Second run: nothing new upstream, but the unfinished file resumes at ingest
+    monkeypatch.setattr(run_pipeline.processing, "process_csv_members", real_process)
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    assert downloads == ["202401-divvy-tripdata.zip"]
+    assert stage_journal.load_state()["202401-divvy-tripdata.zip"]["stage"] == "ingested"
+    assert len(refreshes) == 1
+    with duckdb.connect(str(tmp_path / "test.duckdb")) as con:
+        assert con.execute("SELECT COUNT(*) FROM trips").fetchone()[0] == 2
+
+def test_every_trip_member_of_archive_is_ingested(tmp_path, pipeline_env):
+    header = "trip_id,start_time\n"
+    pipeline_env({"Divvy_Trips_2017_Q1Q2.zip": {
+        "Divvy_Trips_2017_Q1.csv": header + "1,2017-01-01\n2,2017-01-02\n",
+        "Divvy_Trips_2017_Q2.csv": header + "3,2017-04-01\n",
+        "Divvy_Stations_2017_Q1Q2.csv": "id,name\n1,Clark St\n",
+        "__MACOSX/._Divvy_Trips_2017_Q1.csv": "junk",
+    }})
+
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    with duckdb.connect(str(tmp_path / "test.duckdb")) as con:
+        counts = dict(con.execute("SELECT source_file, COUNT(*) FROM trips GROUP BY 1").fetchall())
+        # Pre-2020 rows have no coordinates, but the OD tables are still rebuilt
+        assert con.execute("SELECT COUNT(*) FROM trips_od_p5").fetchone()[0] == 0
+    assert counts == {"Divvy_Trips_2017_Q1": 2, "Divvy_Trips_2017_Q2": 1}
+
+    log_df = pd.read_csv(tmp_path / "file_ingestion_log.csv")
+    assert list(log_df["file_name"]) == ["Divvy_Trips_2017_Q1.csv", "Divvy_Trips_2017_Q2.csv"]
+    assert list(log_df["inserted_rows"]) == [2, 1]
+
+def test_pandas_mode_ingest_counts_as_success(monkeypatch, tmp_path, pipeline_env):
+    pipeline_env({"202401-divvy-tripdata.zip": {
+        "202401-divvy-tripdata.csv": "ride_id,started_at\nA1,2024-01-01\nA2,2024-01-02\n"
+    }})
+
+    calls = []
+    real_process = processing.process_csv_file
+    def counting_process(*args, **kwargs):
+        calls.append(args)
+        return real_process(*args, **kwargs)
+    monkeypatch.setattr(run_pipeline.processing, "process_csv_file", counting_process)
+
+    run_pipeline.run(mode="pandas", quality_check=False)
+
+    # The returned DataFrame is a success: no retries, and the file isn't pending next run
+    assert len(calls) == 1
+    assert stage_journal.load_state()["202401-divvy-tripdata.zip"]["stage"] == "ingested"
+    log_df = pd.read_csv(tmp_path / "file_ingestion_log.csv")
+    assert list(log_df["status"]) == ["success"]
+    assert list(log_df["inserted_rows"]) == [2]
+
+def test_partly_failed_archive_logs_and_refreshes_loaded_members(monkeypatch, tmp_path, pipeline_env):
+    pipeline_env({"Divvy_Trips_2019_Q4_2020_Q1.zip": {
+        "Divvy_Trips_2019_Q4.csv": "trip_id,start_time\n1,2019-12-31\n2,2019-12-31\n",
+        "Divvy_Trips_2020_Q1.csv": "ride_id,started_at\nA1,2020-01-01 10:00\n",
+    }})
+
+    # The 2020 era fails on every attempt, after the 2019 era has committed
+    real_ensure = processing.derived.ensure_trips_columns
+    def failing_ensure(con, columns):
+        if "ride_id" in columns:
+            raise RuntimeError("disk full")
+        real_ensure(con, columns)
+    monkeypatch.setattr(processing.derived, "ensure_trips_columns", failing_ensure)
+
+    refreshes = []
+    real_refresh = run_pipeline.refresh_spatial_aggregates
+    monkeypatch.setattr(run_pipeline, "refresh_spatial_aggregates", lambda: refreshes.append(real_refresh()))
+
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    log_df = pd.read_csv(tmp_path / "file_ingestion_log.csv").set_index("file_name")
+    assert log_df.loc["Divvy_Trips_2019_Q4.csv", "status"] == "success"
+    assert log_df.loc["Divvy_Trips_2019_Q4.csv", "inserted_rows"] == 2
+    assert log_df.loc["Divvy_Trips_2020_Q1.csv", "status"] == "failed"
+    # The archive stays pending, but the rows that did load reach the OD tables
+    assert stage_journal.load_state()["Divvy_Trips_2019_Q4_2020_Q1.zip"]["stage"] == "extracted"
+    assert len(refreshes) == 1
+
+def test_archive_without_trip_members_is_finished(tmp_path, pipeline_env):
+    downloads = pipeline_env({"Divvy_Stations_2017.zip": {
+        "Divvy_Stations_2017_Q1Q2.csv": "id,name\n1,Clark St\n",
+    }})
+
+    run_pipeline.run(mode="duckdb", quality_check=False)
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    # Journaled as done on the first run, so the second run doesn't reopen it
+    assert downloads == ["Divvy_Stations_2017.zip"]
+    assert stage_journal.load_state()["Divvy_Stations_2017.zip"]["stage"] == "ingested"
+    log_df = pd.read_csv(tmp_path / "file_ingestion_log.csv")
+    assert list(log_df["file_name"]) == ["Divvy_Stations_2017.zip"]
+    assert list(log_df["status"]) == ["skipped"]
+
+def test_ingest_resumes_from_extracted_files_without_zip(monkeypatch, tmp_path, pipeline_env):
+    pipeline_env({"202401-divvy-tripdata.zip": {
+        "202401-divvy-tripdata.csv": "ride_id,started_at\nA1,2024-01-01\n",
+    }})
+
+    real_process = processing.process_csv_members
+    def crashing_process(*args, **kwargs):
+        raise RuntimeError("worker died")
+    monkeypatch.setattr(run_pipeline.processing, "process_csv_members", crashing_process)
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    os.remove(tmp_path / "zip" / "202401-divvy-tripdata.zip")
+    monkeypatch.setattr(run_pipeline.processing, "process_csv_members", real_process)
+    run_pipeline.run(mode="duckdb", quality_check=False)
+
+    assert stage_journal.load_state()["202401-divvy-tripdata.zip"]["stage"] == "ingested"
+    with duckdb.connect(str(tmp_path / "test.duckdb")) as con:
+        assert con.execute("SELECT COUNT(*) FROM trips").fetchone()[0] == 1
@@ -0,0 +1,80 @@
+import random
+import duckdb
+import pytest
+from s3_divvy import spatial
+
+@pytest.fixture
+def trips_con():
+    # Points scattered over Chicago, with cells computed by the ingest SQL
+    rng = random.Random(7)
+    rows = [
+        (f"R{i}", rng.uniform(41.70, 42.05), rng.uniform(-87.90, -87.55),
+         rng.uniform(41.70, 42.05), rng.uniform(-87.90, -87.55))
+        for i in range(500)
+    ]
+    con = duckdb.connect()
+    con.execute("CREATE TABLE pts (ride_id VARCHAR, start_lat DOUBLE, start_lng DOUBLE, end_lat DOUBLE, end_lng DOUBLE)")
+    con.executemany("INSERT INTO pts VALUES (?, ?, ?, ?, ?)", rows)
+    con.execute(f"""
+        CREATE TABLE trips AS SELECT
+            ride_id,
+            CAST(start_lat AS VARCHAR) AS start_lat, CAST(start_lng AS VARCHAR) AS start_lng,
+            CAST(end_lat AS VARCHAR) AS end_lat, CAST(end_lng AS VARCHAR) AS end_lng,
+            {spatial.geohash_sql('start_lat', 'start_lng', 7)} AS start_cell,
+            {spatial.geohash_sql('end_lat', 'end_lng', 7)} AS end_cell,
+            CAST(600 AS DOUBLE) AS ride_length_sec,
+            CAST(1 AS DOUBLE) AS ride_distance_km
+        FROM pts
+    """)
+    yield con, rows
+    con.close()
+
+def test_encode_geohash_known_value():
+    assert spatial.encode_geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+def test_sql_geohash_matches_python(trips_con):
+    con, rows = trips_con
+    cells = dict(con.execute("SELECT ride_id, start_cell FROM trips").fetchall())
+    for ride_id, lat, lng, _, _ in rows:
+        assert cells[ride_id] == spatial.encode_geohash(lat, lng, 7)
+
+def test_sql_geohash_null_for_invalid_coordinates():
+    con = duckdb.connect()
+    sql = spatial.geohash_sql("CAST(lat AS DOUBLE)", "CAST(lng AS DOUBLE)", 7)
+    result = con.execute(f"SELECT {sql} FROM (VALUES (NULL, NULL), (95.0, 0.0)) t(lat, lng)").fetchall()
+    assert result == [(None,), (None,)]
+    con.close()
+
+def test_cover_cells_bounds_cell_count():
+    precision, cells = spatial.cover_cells(41.80, -87.70, 41.90, -87.60)
+    assert len(cells) <= spatial.MAX_COVER_CELLS
+    assert spatial.encode_geohash(41.85, -87.65, precision) in cells
+
+def test_near_query_matches_brute_force(trips_con):
+    con, rows = trips_con
+    lat, lng, radius_km = 41.88, -87.63, 3.0
+
+    sql = spatial.near_query_sql(lat, lng, radius_km, select="ride_id")
+    found = {r[0] for r in con.execute(sql).fetchall()}
+
+    brute = con.execute(f"""
+        SELECT ride_id FROM pts
+        WHERE {spatial.haversine_sql('start_lat', 'start_lng', str(lat), str(lng))} <= {radius_km}
+    """).fetchall()
+    assert found == {r[0] for r in brute}
+    assert found
+
+def test_near_query_rejects_unknown_endpoint():
+    with pytest.raises(ValueError):
+        spatial.near_query_sql(41.88, -87.63, 1.0, endpoint="middle")
+
+def test_refresh_od_aggregates(trips_con):
+    con, rows = trips_con
+    spatial.refresh_od_aggregates(con, precisions=[4, 5])
+
+    for precision in (4, 5):
+        total, max_len = con.execute(f"""
+            SELECT SUM(trip_count), MAX(length(start_cell)) FROM {spatial.od_table_name(precision)}
+        """).fetchone()
+        assert total == len(rows)
+        assert max_len == precision
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+from s3_divvy import stage_journal
+
+@pytest.fixture(autouse=True)
+def journal_path(tmp_path, monkeypatch):
+    path = tmp_path / "file_stage_journal.csv"
+    monkeypatch.setattr(stage_journal.config, "STAGE_JOURNAL_PATH", str(path))
+    monkeypatch.setattr(stage_journal.config, "STAGE_BACKOFF_SEC", 0)
+    return path
+
+def test_load_state_keeps_last_completed_stage():
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "listed")
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "downloaded")
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "verified", status="failed")
+
+    state = stage_journal.load_state()
+    assert stage_journal.completed_stage(state, "a.zip", pd.Timestamp("2024-01-01", tz="UTC")) == "downloaded"
+    assert stage_journal.is_done(state, "a.zip", "2024-01-01T00:00:00+00:00", "listed")
+    assert not stage_journal.is_done(state, "a.zip", "2024-01-01T00:00:00+00:00", "verified")
+
+def test_republished_file_starts_over():
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "ingested")
+    state = stage_journal.load_state()
+    assert stage_journal.completed_stage(state, "a.zip", "2024-02-01T00:00:00+00:00") is None
+
+def test_truncated_last_line_is_ignored(journal_path):
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "extracted")
+    with open(journal_path, "a") as f:
+        f.write("a.zip,2024-01-01T00:00:00+00:00,inge")
+    assert stage_journal.load_state()["a.zip"]["stage"] == "extracted"
+
+def test_pending_files_excludes_ingested_and_unknown():
+    stage_journal.record_stage("a.zip", "2024-01-01T00:00:00+00:00", "extracted")
+    stage_journal.record_stage("b.zip", "2024-01-01T00:00:00+00:00", "ingested")
+    current = pd.DataFrame({
+        "file_name": ["a.zip", "b.zip", "c.zip"],
+        "size": [1, 2, 3],
+        "last_modified": ["2024-01-01T00:00:00+00:00"] * 3,
+    })
+    pending = stage_journal.pending_files(stage_journal.load_state(), current)
+    assert list(pending["file_name"]) == ["a.zip"]
+
+def test_run_with_retries_recovers_from_transient_failure():
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset by peer")
+        return "ok"
+
+    result = stage_journal.run_with_retries("downloaded", "a.zip", "2024-01-01", flaky)
+    assert result == "ok"
+    assert len(calls) == 3
+    assert stage_journal.load_state()["a.zip"]["stage"] == "downloaded"
+
+def test_run_with_retries_journals_exhausted_failure(journal_path):
+    result = stage_journal.run_with_retries("downloaded", "a.zip", "2024-01-01", lambda: None, attempts=2)
+    assert result is None
+    assert "a.zip" not in stage_journal.load_state()
+    rows = pd.read_csv(journal_path)
+    assert rows.iloc[-1]["status"] == "failed"
+    assert rows.iloc[-1]["attempts"] == 2